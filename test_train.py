@@ -0,0 +1,188 @@
+"""
+Unit tests for the training helpers in train.py
+Run with: python -m pytest test_train.py
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+
+from torch import nn
+
+from train import augment_batch, fit, load_training_state, split_samples, train_one_epoch
+
+
+def make_samples(counts):
+    """Build fake (path, label) samples with counts[label] images per class."""
+    return [(f"class{label}/{i}.jpg", label) for label, count in enumerate(counts) for i in range(count)]
+
+
+class TestSplitSamples:
+    def test_stratified_per_class(self):
+        train, val = split_samples(make_samples([10, 20, 30]), 0.2, seed=0)
+        val_counts = [sum(1 for _, label in val if label == c) for c in range(3)]
+        assert val_counts == [2, 4, 6]
+        assert len(train) + len(val) == 60
+        assert not set(train) & set(val)
+
+    def test_deterministic_for_seed(self):
+        samples = make_samples([10, 10])
+        assert split_samples(samples, 0.3, seed=1) == split_samples(samples, 0.3, seed=1)
+        assert split_samples(samples, 0.3, seed=1) != split_samples(samples, 0.3, seed=2)
+
+    def test_small_classes_keep_one_sample_in_each_split(self):
+        train, val = split_samples(make_samples([2, 3, 1]), 0.1, seed=0)
+        assert sorted(label for _, label in val) == [0, 1]
+        assert sorted(label for _, label in train) == [0, 1, 1, 2]
+
+    def test_large_fraction_keeps_train_split(self):
+        train, val = split_samples(make_samples([10]), 0.99, seed=0)
+        assert len(train) == 1 and len(val) == 9
+
+    @pytest.mark.parametrize("val_fraction", [0, 1, -0.1, 1.5])
+    def test_rejects_out_of_range_fraction(self, val_fraction):
+        with pytest.raises(ValueError):
+            split_samples(make_samples([10]), val_fraction, seed=0)
+
+
+class TestAugmentBatch:
+    def test_shape_and_value_range(self):
+        images = torch.rand(8, 3, 32, 32)
+        augmented = augment_batch(images.clone(), max_shift=4)
+        assert augmented.shape == images.shape
+        assert augmented.min() >= 0. and augmented.max() <= 1.
+
+    def test_flip(self):
+        images = torch.rand(4, 3, 16, 16)
+        augmented = augment_batch(images.clone(), flip_prob=1., jitter=0., max_shift=0)
+        assert torch.equal(augmented, images.flip(-1))
+
+    def test_no_op_when_disabled(self):
+        images = torch.rand(4, 3, 16, 16)
+        augmented = augment_batch(images.clone(), flip_prob=0., jitter=0., max_shift=0)
+        assert torch.equal(augmented, images)
+
+    def test_shift_zero_fills_instead_of_wrapping(self):
+        torch.manual_seed(0)
+        images = torch.zeros(64, 1, 32, 32)
+        images[..., 0] = 1.  # Only the leftmost column is lit
+        augmented = augment_batch(images, flip_prob=0., jitter=0., max_shift=4)
+        assert augmented[..., -4:].sum() == 0
+        # Pixels are moved, not interpolated
+        assert set(augmented.unique().tolist()) <= {0., 1.}
+        # Per-sample shifts: not every image moved the same way
+        assert not all(torch.equal(augmented[0], image) for image in augmented)
+
+
+class TestGradientAccumulation:
+    def make_batches(self, batch_sizes):
+        torch.manual_seed(0)
+        return [(torch.randn(size, 5), torch.randint(0, 3, (size,))) for size in batch_sizes]
+
+    def full_batch_step(self, model, optimizer, loss_fn, batches):
+        images = torch.cat([images for images, _ in batches])
+        labels = torch.cat([labels for _, labels in batches])
+        optimizer.zero_grad()
+        loss_fn(model(images), labels).backward()
+        optimizer.step()
+
+    @pytest.mark.parametrize("batch_sizes, accumulation_steps", [
+        ([4, 4, 4], 3),
+        ([4, 4, 4, 4, 4], 3),
+        ([4, 4, 4, 4], 1),
+        ([4, 4, 1], 3),  # Short last batch in a full group
+        ([4, 4, 4, 4, 2], 2),  # Short last batch in a partial group
+    ])
+    def test_matches_full_batch_steps(self, batch_sizes, accumulation_steps):
+        batches = self.make_batches(batch_sizes)
+        num_batches = len(batches)
+        loss_fn = nn.CrossEntropyLoss()
+
+        torch.manual_seed(1)
+        accumulated = nn.Linear(5, 3)
+        reference = nn.Linear(5, 3)
+        reference.load_state_dict(accumulated.state_dict())
+
+        train_one_epoch(accumulated, batches, loss_fn, torch.optim.SGD(accumulated.parameters(), lr=0.5),
+                        accumulation_steps, augment=False)
+
+        optimizer = torch.optim.SGD(reference.parameters(), lr=0.5)
+        for start in range(0, num_batches, accumulation_steps):
+            self.full_batch_step(reference, optimizer, loss_fn, batches[start:start + accumulation_steps])
+
+        for param, expected in zip(accumulated.parameters(), reference.parameters()):
+            assert torch.allclose(param, expected, atol=1e-6)
+
+
+def make_loaders():
+    """Tiny in-memory train/validation batches for a linear classifier."""
+    torch.manual_seed(0)
+    train = [(torch.randn(4, 5), torch.randint(0, 3, (4,))) for _ in range(3)]
+    val = [(torch.randn(4, 5), torch.randint(0, 3, (4,)))]
+    return train, val
+
+
+RUN_CONFIG = {'seed': 0, 'val_fraction': 0.2, 'batch_size': 4, 'accumulation_steps': 1, 'class_names': ['a', 'b', 'c']}
+
+
+class TestTrainingLoop:
+    def setup_method(self):
+        torch.manual_seed(1)
+        self.model = nn.Linear(5, 3)
+        self.optimizer = torch.optim.SGD(self.model.parameters(), lr=0.1)
+        self.loss_fn = nn.CrossEntropyLoss()
+        self.train, self.val = make_loaders()
+
+    def load_state(self, checkpoint_path, **kwargs):
+        return load_training_state(self.model, self.optimizer, self.loss_fn, self.val,
+                                   kwargs.pop('run_config', RUN_CONFIG), checkpoint_path, **kwargs)
+
+    def run_fit(self, state, tmp_path, epochs, patience=5):
+        return fit(self.model, self.train, self.val, self.loss_fn, self.optimizer, state, RUN_CONFIG,
+                   epochs, patience, accumulation_steps=1, augment=False,
+                   output_path=tmp_path / "model.pth", checkpoint_path=tmp_path / "checkpoint.pth")
+
+    def test_fresh_start_without_checkpoint(self, tmp_path):
+        state = self.load_state(tmp_path / "checkpoint.pth", resume=True)
+        assert state == {'start_epoch': 0, 'best_val_loss': float('inf'),
+                         'epochs_without_improvement': 0, 'resumed': False}
+
+    def test_resume_continues_after_saved_epoch(self, tmp_path):
+        best_val_loss = self.run_fit(self.load_state(tmp_path / "checkpoint.pth"), tmp_path, epochs=2)
+
+        state = self.load_state(tmp_path / "checkpoint.pth", resume=True)
+        assert state['resumed']
+        assert state['start_epoch'] == 2
+        assert state['best_val_loss'] == best_val_loss
+
+    def test_resume_rejects_config_mismatch(self, tmp_path):
+        self.run_fit(self.load_state(tmp_path / "checkpoint.pth"), tmp_path, epochs=1)
+        with pytest.raises(ValueError, match="val_fraction"):
+            self.load_state(tmp_path / "checkpoint.pth", resume=True,
+                            run_config={**RUN_CONFIG, 'val_fraction': 0.3})
+
+    def test_resume_rejects_init_weights(self, tmp_path):
+        self.run_fit(self.load_state(tmp_path / "checkpoint.pth"), tmp_path, epochs=1)
+        with pytest.raises(ValueError, match="init-weights"):
+            self.load_state(tmp_path / "checkpoint.pth", resume=True, init_weights=tmp_path / "model.pth")
+
+    def test_stops_when_patience_reached(self, tmp_path):
+        for group in self.optimizer.param_groups:
+            group['lr'] = 0.  # Validation loss can never improve after epoch 1
+        self.run_fit(self.load_state(tmp_path / "checkpoint.pth"), tmp_path, epochs=10, patience=2)
+
+        checkpoint = torch.load(tmp_path / "checkpoint.pth")
+        assert checkpoint['epoch'] == 2
+        assert checkpoint['epochs_without_improvement'] == 2
+
+    def test_fine_tuning_keeps_output_unless_improved(self, tmp_path):
+        init_weights = tmp_path / "init.pth"
+        torch.save(self.model.state_dict(), init_weights)
+        for group in self.optimizer.param_groups:
+            group['lr'] = 0.
+
+        state = self.load_state(tmp_path / "checkpoint.pth", init_weights=init_weights)
+        assert state['best_val_loss'] < float('inf')
+        self.run_fit(state, tmp_path, epochs=3)
+        assert not (tmp_path / "model.pth").exists()
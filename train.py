@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Training / fine-tuning script for the Eye Disease Prediction model.
+Produces state dicts compatible with models/MultipleEyeDiseaseDetectModel.pth
+and is tuned for CPU-only machines.
+"""
+
+import argparse
+import os
+import random
+import time
+from pathlib import Path
+
+import torch
+import torchvision
+from torch import nn
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Dataset
+from torchvision.io import ImageReadMode
+import torchvision.transforms as transforms
+
+from model import ImprovedTinyVGGModel
+
+IMAGE_SIZE = (224, 224)
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif'}
+MODEL_SAVE_PATH = "models/MultipleEyeDiseaseDetectModel.finetuned.pth"
+CHECKPOINT_PATH = "models/checkpoint.pth"
+
+# Must match the model instantiated by app.predict_image_api
+HIDDEN_UNITS = 48
+NUM_CLASSES = 6
+
+
+class EyeImageDataset(Dataset):
+    """
+    Eye images stored as one sub-directory per class (e.g. testingImages/).
+    Class indices follow the sorted directory names, which matches the
+    class_names order used by the API.
+    """
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.resize = transforms.Resize(IMAGE_SIZE, antialias=True)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        image_path, label = self.samples[index]
+        # Same preprocessing as utils.load_and_preprocess_image, forced to RGB
+        image = torchvision.io.read_image(str(image_path), ImageReadMode.RGB)
+        image = image.type(torch.float32) / 255.
+        return self.resize(image), label
+
+
+def find_samples(data_dir):
+    """
+    Collect (image_path, label) pairs and the class names from data_dir.
+    """
+    class_dirs = sorted(d for d in Path(data_dir).iterdir() if d.is_dir())
+    if not class_dirs:
+        raise ValueError(f"No class directories found in {data_dir}")
+
+    samples = []
+    for label, class_dir in enumerate(class_dirs):
+        for image_path in sorted(class_dir.iterdir()):
+            if image_path.suffix.lower() in IMAGE_EXTENSIONS:
+                samples.append((image_path, label))
+    return samples, [d.name for d in class_dirs]
+
+
+def split_samples(samples, val_fraction, seed):
+    """
+    Split samples into train and validation lists, stratified per class so
+    every class with at least 2 images is represented in both splits.
+    """
+    if not 0 < val_fraction < 1:
+        raise ValueError(f"val_fraction must be between 0 and 1, got {val_fraction}")
+
+    by_label = {}
+    for sample in samples:
+        by_label.setdefault(sample[1], []).append(sample)
+
+    rng = random.Random(seed)
+    train_samples, val_samples = [], []
+    for label in sorted(by_label):
+        class_samples = by_label[label]
+        rng.shuffle(class_samples)
+        n_val = int(round(len(class_samples) * val_fraction))
+        if len(class_samples) >= 2:
+            n_val = min(max(n_val, 1), len(class_samples) - 1)
+        else:
+            n_val = 0
+        val_samples.extend(class_samples[:n_val])
+        train_samples.extend(class_samples[n_val:])
+    return train_samples, val_samples
+
+
+def augment_batch(images, flip_prob=0.5, jitter=0.2, max_shift=16):
+    """
+    Apply random augmentation to a whole batch at once as tensor ops:
+    horizontal flip, brightness/contrast jitter and a small per-sample
+    translation of up to max_shift pixels, with uncovered pixels zero-filled.
+    """
+    batch_size, _, height, width = images.shape
+
+    # Random horizontal flip per sample
+    flip = torch.rand(batch_size, 1, 1, 1) < flip_prob
+    images = torch.where(flip, images.flip(-1), images)
+
+    # Brightness and contrast jitter per sample
+    if jitter > 0:
+        brightness = torch.empty(batch_size, 1, 1, 1).uniform_(1 - jitter, 1 + jitter)
+        contrast = torch.empty(batch_size, 1, 1, 1).uniform_(1 - jitter, 1 + jitter)
+        mean = images.mean(dim=(1, 2, 3), keepdim=True)
+        images = ((images - mean) * contrast + mean) * brightness
+
+    # Integer pixel shifts as per-sample affine grids (2 / size per pixel)
+    if max_shift > 0:
+        shifts = torch.randint(-max_shift, max_shift + 1, (batch_size, 2)).to(images.dtype)
+        theta = torch.zeros(batch_size, 2, 3, dtype=images.dtype)
+        theta[:, 0, 0] = 1.
+        theta[:, 1, 1] = 1.
+        theta[:, 0, 2] = shifts[:, 0] * 2 / width
+        theta[:, 1, 2] = shifts[:, 1] * 2 / height
+        grid = F.affine_grid(theta, list(images.shape), align_corners=False)
+        images = F.grid_sample(images, grid, mode='nearest', padding_mode='zeros', align_corners=False)
+
+    return images.clamp_(0., 1.)
+
+
+def make_dataloader(dataset, batch_size, shuffle, num_workers, prefetch_factor, persistent=True):
+    """
+    Build a DataLoader that decodes images in worker processes and keeps
+    batches prefetched ahead of the training loop.
+    """
+    worker_options = {}
+    if num_workers > 0:
+        worker_options = {
+            'prefetch_factor': prefetch_factor,
+            'persistent_workers': persistent,
+        }
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=num_workers,
+        pin_memory=False,  # No accelerator to pin for on CPU-only nodes
+        **worker_options
+    )
+
+
+def train_one_epoch(model, dataloader, loss_fn, optimizer, accumulation_steps, augment):
+    """
+    Train for one epoch with gradient accumulation. loss_fn must average over
+    the batch (the default for nn.CrossEntropyLoss).
+    Returns (average loss, accuracy, images processed).
+    """
+    model.train()
+    total_loss, correct, seen = 0., 0, 0
+    group_seen = 0
+    num_batches = len(dataloader)
+    optimizer.zero_grad(set_to_none=True)
+
+    for batch, (images, labels) in enumerate(dataloader):
+        if augment:
+            images = augment_batch(images)
+
+        logits = model(images)
+        loss = loss_fn(logits, labels)
+
+        # Accumulate per-sample sums and divide by the group's sample count
+        # before stepping, so the gradient matches one large batch even when
+        # the last batch or group of the epoch is short
+        (loss * labels.shape[0]).backward()
+        group_seen += labels.shape[0]
+
+        if (batch + 1) % accumulation_steps == 0 or batch + 1 == num_batches:
+            for param in model.parameters():
+                if param.grad is not None:
+                    param.grad /= group_seen
+            group_seen = 0
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+
+        total_loss += loss.item() * labels.shape[0]
+        correct += (logits.argmax(dim=1) == labels).sum().item()
+        seen += labels.shape[0]
+
+    return total_loss / seen, correct / seen, seen
+
+
+def evaluate(model, dataloader, loss_fn):
+    """
+    Evaluate the model. Returns (average loss, accuracy, images processed).
+    """
+    model.eval()
+    total_loss, correct, seen = 0., 0, 0
+    with torch.inference_mode():
+        for images, labels in dataloader:
+            logits = model(images)
+            total_loss += loss_fn(logits, labels).item() * labels.shape[0]
+            correct += (logits.argmax(dim=1) == labels).sum().item()
+            seen += labels.shape[0]
+    return total_loss / seen, correct / seen, seen
+
+
+def save_atomic(path, state):
+    """
+    Save with torch.save atomically so an interrupted write never leaves a
+    corrupt file behind (the API may be loading the model concurrently).
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_training_state(model, optimizer, loss_fn, val_dataloader, run_config,
+                        checkpoint_path, resume=False, init_weights=None):
+    """
+    Resume from checkpoint_path or load init_weights into the model.
+    Returns a dict with start_epoch, best_val_loss, epochs_without_improvement
+    and resumed.
+    """
+    state = {
+        'start_epoch': 0,
+        'best_val_loss': float('inf'),
+        'epochs_without_improvement': 0,
+        'resumed': False,
+    }
+
+    if resume and os.path.exists(checkpoint_path):
+        if init_weights:
+            raise ValueError(f"--init-weights cannot be used when resuming from {checkpoint_path}")
+        checkpoint = torch.load(checkpoint_path, map_location=torch.device('cpu'))
+        saved_config = checkpoint.get('run_config', {})
+        mismatched = [key for key in run_config if saved_config.get(key) != run_config[key]]
+        if mismatched:
+            raise ValueError(f"Checkpoint {checkpoint_path} was created with different settings: "
+                             + ", ".join(f"{key}={saved_config.get(key)!r}" for key in mismatched))
+        model.load_state_dict(checkpoint['model_state_dict'])
+        optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+        torch.set_rng_state(checkpoint['rng_state'])
+        state.update(
+            start_epoch=checkpoint['epoch'] + 1,
+            best_val_loss=checkpoint['best_val_loss'],
+            epochs_without_improvement=checkpoint['epochs_without_improvement'],
+            resumed=True,
+        )
+        print(f"Resumed from {checkpoint_path} at epoch {state['start_epoch'] + 1}")
+    elif init_weights:
+        model.load_state_dict(torch.load(init_weights, map_location=torch.device('cpu')))
+        # Only save a fine-tuned model if it beats the starting weights
+        best_val_loss, val_acc, _ = evaluate(model, val_dataloader, loss_fn)
+        state['best_val_loss'] = best_val_loss
+        print(f"Fine-tuning from {init_weights} "
+              f"(val loss {best_val_loss:.4f} acc {val_acc:.3f})")
+
+    return state
+
+
+def fit(model, train_dataloader, val_dataloader, loss_fn, optimizer, state, run_config,
+        epochs, patience, accumulation_steps, augment, output_path, checkpoint_path):
+    """
+    Run the epoch loop from state['start_epoch'], saving the best model to
+    output_path and a resumable checkpoint after every epoch.
+    Returns the best validation loss.
+    """
+    best_val_loss = state['best_val_loss']
+    epochs_without_improvement = state['epochs_without_improvement']
+
+    for epoch in range(state['start_epoch'], epochs):
+        start_time = time.perf_counter()
+        train_loss, train_acc, train_seen = train_one_epoch(
+            model, train_dataloader, loss_fn, optimizer, accumulation_steps, augment)
+        train_time = time.perf_counter() - start_time
+
+        val_start_time = time.perf_counter()
+        val_loss, val_acc, val_seen = evaluate(model, val_dataloader, loss_fn)
+        val_time = time.perf_counter() - val_start_time
+
+        print(f"Epoch {epoch + 1}/{epochs} | "
+              f"train loss {train_loss:.4f} acc {train_acc:.3f} | "
+              f"val loss {val_loss:.4f} acc {val_acc:.3f} | "
+              f"train {train_seen / train_time:.1f} img/s, val {val_seen / val_time:.1f} img/s, "
+              f"{time.perf_counter() - start_time:.1f}s")
+
+        if val_loss < best_val_loss:
+            best_val_loss = val_loss
+            epochs_without_improvement = 0
+            # Plain state dict, loadable by app.predict_image_api
+            save_atomic(output_path, model.state_dict())
+            print(f"Saved best model to {output_path}")
+        else:
+            epochs_without_improvement += 1
+
+        save_atomic(checkpoint_path, {
+            'epoch': epoch,
+            'model_state_dict': model.state_dict(),
+            'optimizer_state_dict': optimizer.state_dict(),
+            'rng_state': torch.get_rng_state(),
+            'best_val_loss': best_val_loss,
+            'epochs_without_improvement': epochs_without_improvement,
+            'run_config': run_config,
+        })
+
+        if epochs_without_improvement >= patience:
+            print(f"Early stopping: no validation improvement for {patience} epochs")
+            break
+
+    return best_val_loss
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train or fine-tune the eye disease model on CPU")
+    parser.add_argument('--data-dir', default='testingImages', help='Directory with one sub-directory per class')
+    parser.add_argument('--output', default=MODEL_SAVE_PATH,
+                        help='Where to save the best model state dict (the API loads '
+                             'models/MultipleEyeDiseaseDetectModel.pth)')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH, help='Resumable training checkpoint path')
+    parser.add_argument('--resume', action='store_true', help='Resume from --checkpoint if it exists')
+    parser.add_argument('--init-weights', default=None, help='State dict to fine-tune from')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--accumulation-steps', type=int, default=4,
+                        help='Batches to accumulate per optimizer step (effective batch = batch-size * this)')
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--weight-decay', type=float, default=1e-4)
+    parser.add_argument('--val-fraction', type=float, default=0.2)
+    parser.add_argument('--patience', type=int, default=5, help='Epochs without val loss improvement before stopping')
+    parser.add_argument('--num-workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--prefetch-factor', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=None, help='Intra-op threads for torch (default: torch picks)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-augment', action='store_true', help='Disable batch augmentation')
+    return parser.parse_args()
+
+
+def main():
+    """Main function to train the model."""
+    args = parse_args()
+    if args.accumulation_steps < 1:
+        raise ValueError("--accumulation-steps must be at least 1")
+    if args.patience < 1:
+        raise ValueError("--patience must be at least 1")
+
+    torch.manual_seed(args.seed)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    samples, class_names = find_samples(args.data_dir)
+    if len(class_names) != NUM_CLASSES:
+        raise ValueError(f"Expected {NUM_CLASSES} class directories in {args.data_dir} to match the API model, "
+                         f"found {len(class_names)}: {class_names}")
+
+    train_samples, val_samples = split_samples(samples, args.val_fraction, args.seed)
+    if not train_samples or not val_samples:
+        raise ValueError("Train or validation split is empty, add images or adjust --val-fraction")
+    print(f"Classes: {class_names}")
+    print(f"Train images: {len(train_samples)}, validation images: {len(val_samples)}")
+
+    train_dataloader = make_dataloader(EyeImageDataset(train_samples), args.batch_size, True,
+                                       args.num_workers, args.prefetch_factor)
+    # Validation runs briefly once per epoch, so use fewer workers and let
+    # them exit instead of holding memory during training
+    val_dataloader = make_dataloader(EyeImageDataset(val_samples), args.batch_size, False,
+                                     (args.num_workers + 1) // 2, args.prefetch_factor, persistent=False)
+
+    model = ImprovedTinyVGGModel(
+        input_shape=3,
+        hidden_units=HIDDEN_UNITS,
+        output_shape=NUM_CLASSES)
+    loss_fn = nn.CrossEntropyLoss()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+
+    # Settings that must not change between a run and its resumption
+    run_config = {
+        'seed': args.seed,
+        'val_fraction': args.val_fraction,
+        'batch_size': args.batch_size,
+        'accumulation_steps': args.accumulation_steps,
+        'class_names': class_names,
+    }
+
+    state = load_training_state(model, optimizer, loss_fn, val_dataloader, run_config,
+                                args.checkpoint, args.resume, args.init_weights)
+    if state['resumed'] and state['epochs_without_improvement'] >= args.patience:
+        print(f"Checkpoint run already stopped early after {args.patience} epochs without improvement")
+        return
+
+    effective_batch_size = args.batch_size * args.accumulation_steps
+    print(f"Effective batch size: {effective_batch_size}, threads: {torch.get_num_threads()}, "
+          f"workers: {args.num_workers}")
+
+    best_val_loss = fit(model, train_dataloader, val_dataloader, loss_fn, optimizer, state, run_config,
+                        args.epochs, args.patience, args.accumulation_steps, not args.no_augment,
+                        args.output, args.checkpoint)
+
+    print(f"Training finished. Best validation loss: {best_val_loss:.4f}")
+
+
+if __name__ == "__main__":
+    main()